@@ -6,8 +6,9 @@ Author: Enrique A. Alcantara
 Description: 
     Full pipeline analysis of COBE/FIRAS public data.
     1. Ingestion: Fetches data directly from NASA servers (Remote ETL).
-    2. Fallback: Uses local data if connection fails.
-    3. Modeling: Fits Planck's Black Body radiation law.
+    2. Caching: Reuses an on-disk copy of the NASA data between runs.
+    3. Fallback: Uses local data if connection fails.
+    4. Modeling: Fits Planck's Black Body radiation law.
     
     Data Source: NASA Legacy Archive (LAMBDA).
     URL: https://lambda.gsfc.nasa.gov/product/cobe/firas_monopole_get.html
@@ -15,26 +16,56 @@ Description:
 
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-import pandas as pd
+from scipy.optimize import least_squares
 import io
+import os
+import tempfile
+import time
+from email.utils import formatdate
+from pathlib import Path
 import requests
 
 # --- CONSTANTS ---
 NASA_URL = "https://lambda.gsfc.nasa.gov/data/cobe/firas/monopole_spec/firas_monopole_spec_v1.txt"
+CACHE_PATH = Path.home() / '.cache' / 'cobe' / 'firas.npy'
+CACHE_MAX_AGE = 30 * 24 * 3600  # seconds
+
+# Physical constants
+H = 6.626e-34   # J s
+C = 2.998e10    # cm/s
+K_B = 1.381e-23 # J/K
 
 # --- PART 1: ROBUST DATA INGESTION ---
 def fetch_cobe_data():
     """
     Attempts to download data from NASA. 
     Parses the 5-column raw format described in the documentation.
+    Returns an (N, 3) array of Freq, Intensity and Uncertainty columns.
+    A local cache younger than CACHE_MAX_AGE skips the request entirely;
+    an older one is revalidated with If-Modified-Since, and still beats the
+    hardcoded backup when NASA cannot be reached.
     """
+    cached, cache_mtime = load_from_cache()
+    if cached is not None and time.time() - cache_mtime < CACHE_MAX_AGE:
+        print(f"[Cache] Loaded NASA data from {CACHE_PATH}")
+        return cached
+    
     print("[Ingestion] Attempting to fetch data from NASA LAMBDA...")
     try:
         headers = {'User-Agent': 'Mozilla/5.0'}
+        if cached is not None:
+            headers['If-Modified-Since'] = formatdate(cache_mtime, usegmt=True)
         response = requests.get(NASA_URL, headers=headers, timeout=10)
         
-        if response.status_code == 200:
+        if response.status_code == 304 and cached is not None:
+            print("[Cache] Remote data unchanged. Reusing local cache...")
+            try:
+                CACHE_PATH.touch()
+            except OSError as e:
+                print(f"[Warning] Could not refresh cache timestamp: {e}")
+            return cached
+        
+        elif response.status_code == 200:
             print("[Success] Connection established. Parsing raw data...")
             
             # NASA Raw Format:
@@ -44,17 +75,15 @@ def fetch_cobe_data():
             # Col 4: Uncertainty (kJy/sr) 
             # Col 5: Galaxy Model (kJy/sr)
             
-            # 'comment=#' tells pandas to ignore lines starting with #
-            # 'usecols=[0, 1, 3]' grabs only Freq, Intensity, and Uncertainty
-            df = pd.read_csv(
+            # 'comments=#' tells NumPy to ignore lines starting with #
+            # 'usecols=(0, 1, 3)' grabs only Freq, Intensity, and Uncertainty
+            data = np.loadtxt(
                 io.StringIO(response.text), 
-                sep='\s+', 
-                comment='#', 
-                header=None, 
-                usecols=[0, 1, 3], 
-                names=['nu', 'I', 'sigma']
+                comments='#', 
+                usecols=(0, 1, 3)
             )
-            return df
+            save_to_cache(data)
+            return data
             
         else:
             print(f"[Warning] Server returned status code: {response.status_code}")
@@ -62,104 +91,208 @@ def fetch_cobe_data():
             
     except Exception as e:
         print(f"[Error] Could not fetch remote data: {e}")
+        if cached is not None:
+            print("[Fallback] Switching to stale local cache of NASA data...")
+            return cached
         print("[Fallback] Switching to hardcoded local backup data...")
         return get_local_backup_data()
 
+def load_from_cache():
+    """
+    Reads the cached NASA data and its modification time.
+    A missing, corrupt or truncated cache file counts as a miss: (None, None).
+    """
+    try:
+        cache_mtime = CACHE_PATH.stat().st_mtime
+        data = np.load(CACHE_PATH)
+    except FileNotFoundError:
+        return None, None
+    except (OSError, ValueError, EOFError) as e:
+        print(f"[Warning] Ignoring unreadable cache file: {e}")
+        return None, None
+    
+    if data.ndim != 2 or data.shape[1] != 3:
+        print("[Warning] Ignoring cache file with unexpected shape")
+        return None, None
+    return data, cache_mtime
+
+def save_to_cache(data):
+    """
+    Stores the parsed NASA data on disk for later runs.
+    The file is written to a temporary name and atomically moved into place,
+    so an interrupted run never leaves a truncated cache behind.
+    A failed write is reported but never interrupts the pipeline.
+    """
+    tmp_path = None
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=CACHE_PATH.parent, suffix='.tmp', delete=False) as f:
+            tmp_path = f.name
+            np.save(f, data)
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError as e:
+        print(f"[Warning] Could not write cache file: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# Hardcoded backup of the COBE dataset: Freq (cm^-1), Intensity (MJy/sr), Uncertainty (kJy/sr)
+_BACKUP = np.array([
+    [2.27, 200.723, 14],
+    [2.72, 249.508, 19],
+    [3.18, 293.024, 25],
+    [3.63, 327.770, 23],
+    [4.08, 354.081, 22],
+    [4.54, 372.079, 21],
+    [4.99, 381.493, 18],
+    [5.45, 383.478, 18],
+    [5.90, 378.901, 16],
+    [6.35, 368.833, 14],
+    [6.81, 354.063, 13],
+    [7.26, 336.278, 12],
+    [7.71, 316.076, 11],
+    [8.17, 293.924, 10],
+    [8.62, 271.432, 11],
+    [9.08, 248.239, 12],
+    [9.53, 225.940, 14],
+    [9.98, 204.327, 16],
+    [10.44, 183.262, 18],
+    [10.89, 163.830, 22],
+    [11.34, 145.750, 22],
+    [11.80, 128.835, 23],
+    [12.25, 113.568, 23],
+    [12.71, 99.451, 23],
+    [13.16, 87.036, 22],
+    [13.61, 75.876, 21],
+    [14.07, 65.766, 20],
+    [14.52, 57.008, 19],
+    [14.97, 49.223, 19],
+    [15.43, 42.267, 19],
+    [15.88, 36.352, 21],
+    [16.34, 31.062, 23],
+    [16.79, 26.580, 26],
+    [17.24, 22.644, 28],
+    [17.70, 19.255, 30],
+    [18.15, 16.391, 32],
+    [18.61, 13.811, 33],
+    [19.06, 11.716, 35],
+    [19.51, 9.921, 41],
+    [19.97, 8.364, 55],
+    [20.42, 7.087, 88],
+    [20.87, 5.801, 155],
+    [21.33, 4.523, 282]
+], dtype=np.float64)
+
 def get_local_backup_data():
     """
     Hardcoded backup of the COBE dataset. 
     Ensures the script runs even without internet connection.
     """
-    raw_data = """
-    2.27   200.723   14
-    2.72   249.508   19
-    3.18   293.024   25
-    3.63   327.770   23
-    4.08   354.081   22
-    4.54   372.079   21
-    4.99   381.493   18
-    5.45   383.478   18
-    5.90   378.901   16
-    6.35   368.833   14
-    6.81   354.063   13
-    7.26   336.278   12
-    7.71   316.076   11
-    8.17   293.924   10
-    8.62   271.432   11
-    9.08   248.239   12
-    9.53   225.940   14
-    9.98   204.327   16
-    10.44  183.262   18
-    10.89  163.830   22
-    11.34  145.750   22
-    11.80  128.835   23
-    12.25  113.568   23
-    12.71  99.451    23
-    13.16  87.036    22
-    13.61  75.876    21
-    14.07  65.766    20
-    14.52  57.008    19
-    14.97  49.223    19
-    15.43  42.267    19
-    15.88  36.352    21
-    16.34  31.062    23
-    16.79  26.580    26
-    17.24  22.644    28
-    17.70  19.255    30
-    18.15  16.391    32
-    18.61  13.811    33
-    19.06  11.716    35
-    19.51  9.921     41
-    19.97  8.364     55
-    20.42  7.087     88
-    20.87  5.801     155
-    21.33  4.523     282
-    """
-    return pd.read_csv(io.StringIO(raw_data), sep='\s+', header=None, names=['nu', 'I', 'sigma'])
+    return _BACKUP.copy()
 
 # --- PART 2: PHYSICS MODEL ---
 def planck_law(nu_cm, T, A):
     """Theoretical Planck's Law for Black Body Radiation."""
-    h = 6.626e-34   # J s
-    c = 2.998e10    # cm/s
-    k_B = 1.381e-23 # J/K
-    
-    nu_hz = nu_cm * c 
-    exponent = (h * nu_hz) / (k_B * T)
+    # Only two buffers are allocated; every other step is done in place
+    nu_hz = np.multiply(nu_cm, C)
+    exponent = nu_hz * (H / (K_B * T))
     
     with np.errstate(over='ignore'):
-        denominator = np.expm1(exponent)
+        np.expm1(exponent, out=exponent)
+    
+    # expm1 only vanishes at nu = 0, which lies outside the COBE band
+    assert (exponent != 0).all(), "planck_law is undefined at nu = 0"
     
-    denominator[denominator == 0] = np.inf
-    I = A * (nu_hz**3) / denominator
+    I = np.power(nu_hz, 3, out=nu_hz)
+    I *= A
+    I /= exponent
     return I
 
+def _log_planck_residuals(nu_cm, I_obs, sigma):
+    """
+    Builds the weighted log-space residuals of planck_law and their analytic
+    Jacobian, as functions of p = (T, ln A) for least_squares.
+    Fitting in log space balances the ~100x dynamic range of the spectrum;
+    uncertainties propagate as sigma_log = sigma / I.
+    Using ln A keeps log I = ln A + 3 ln nu - ln(e^x - 1) defined for every step.
+    The T-independent terms are computed once and reused on every evaluation.
+    """
+    nu_hz = np.multiply(nu_cm, C)
+    hv_k = nu_hz * (H / K_B)
+    offset = 3 * np.log(nu_hz) - np.log(I_obs)
+    inv_sigma_log = I_obs / sigma
+    
+    def residuals(p):
+        T, ln_A = p
+        x = hv_k / T
+        # ln(e^x - 1) = x + ln(1 - e^-x), which cannot overflow for large x
+        r = np.negative(x)
+        np.expm1(r, out=r)
+        np.negative(r, out=r)
+        np.log(r, out=r)
+        r += x
+        np.subtract(offset, r, out=r)
+        r += ln_A
+        r *= inv_sigma_log
+        return r
+    
+    def jac(p):
+        T, ln_A = p
+        x = hv_k / T
+        J = np.empty((x.size, 2))
+        # dlogI/dT = (x / T) * e^x / (e^x - 1), written to stay finite for large x
+        J[:, 0] = x / (-np.expm1(-x) * T)
+        J[:, 1] = 1.0
+        J *= inv_sigma_log[:, np.newaxis]
+        return J
+    
+    return residuals, jac
+
+def _cov_from_jac(jac):
+    """
+    Parameter covariance (J^T J)^-1 from the Jacobian of the weighted residuals,
+    i.e. absolute sigma. Columns are normalized before the SVD pseudo-inverse so
+    parameters of very different magnitude do not fall below the rank cutoff.
+    """
+    norms = np.linalg.norm(jac, axis=0)
+    _, s, VT = np.linalg.svd(jac / norms, full_matrices=False)
+    threshold = np.finfo(float).eps * max(jac.shape) * s[0]
+    s = s[s > threshold]
+    VT = VT[:s.size]
+    return ((VT.T / s**2) @ VT) / np.outer(norms, norms)
+
 # --- PART 3: ANALYSIS PIPELINE ---
 def run_pipeline():
     # 1. Ingest Data
-    df = fetch_cobe_data()
+    data = fetch_cobe_data()
     
-    nu_data = df['nu'].values
-    I_data = df['I'].values
+    nu_data, I_data, sigma_raw = data.T
     
     # Documentation says Uncertainty (Col 4) is in kJy/sr.
     # Intensity (Col 2) is in MJy/sr.
     # We must convert Uncertainty to MJy/sr to match scales (divide by 1000).
-    sigma_data = df['sigma'].values / 1000.0
+    sigma_data = sigma_raw / 1000.0
 
-    print(f"[Processing] Fitting Planck's Law to {len(df)} observational points...")
+    print(f"[Processing] Fitting Planck's Law to {len(nu_data)} observational points...")
     
     # 2. Model Fitting
-    p0 = [3, 1e-15] 
-    
-    popt, pcov = curve_fit(
-        planck_law, 
-        nu_data, 
-        I_data, 
-        p0=p0, 
-        sigma=sigma_data, 
-        absolute_sigma=True
+    # x_scale='jac' rescales T and ln A to comparable LM step sizes
+    # A starts at 2h/c^2 converted to MJy/sr (c in m/s), its physical value
+    p0 = [3, np.log(2 * H / (C / 100)**2 * 1e20)] 
+    residuals_fn, residuals_jac = _log_planck_residuals(nu_data, I_data, sigma_data)
+    
+    result = least_squares(
+        residuals_fn, 
+        p0, 
+        jac=residuals_jac, 
+        method='lm', 
+        x_scale='jac'
     )
+    if not result.success:
+        raise RuntimeError(f"Planck fit did not converge: {result.message}")
+    
+    # Var(T) does not depend on the ln A parametrization
+    popt = np.array([result.x[0], np.exp(result.x[1])])
+    pcov = _cov_from_jac(result.jac)
     
     T_fit, A_fit = popt
     perr = np.sqrt(np.diag(pcov))
@@ -178,7 +311,16 @@ def run_pipeline():
     ax1 = plt.subplot2grid((3, 1), (0, 0), rowspan=2)
     ax1.errorbar(nu_data, I_data, yerr=sigma_data, fmt='ko', markersize=3, label='COBE Data', alpha=0.6)
     
-    nu_smooth = np.linspace(min(nu_data), max(nu_data), 500)
+    # 150 points are smooth at 100 dpi: the 60 below 1.5x the Wien peak
+    # (nu_peak = 2.821 k_B T / (h c)), where the curve turns over, are spaced
+    # more finely than the 90 in the tail. The breakpoint is clipped to the
+    # data range so the grid stays monotonic.
+    nu_peak = 2.821 * K_B * T_fit / (H * C)
+    nu_break = np.clip(1.5 * nu_peak, nu_data.min(), nu_data.max())
+    nu_smooth = np.concatenate([
+        np.linspace(nu_data.min(), nu_break, 60, endpoint=False),
+        np.linspace(nu_break, nu_data.max(), 90)
+    ])
     ax1.plot(nu_smooth, planck_law(nu_smooth, *popt), 'r-', linewidth=2, label=f'Planck Fit (T={T_fit:.4f}K)')
     ax1.set_ylabel("Intensity [MJy/sr]")
     ax1.set_title("Cosmic Microwave Background Spectrum Analysis (NASA Data)")
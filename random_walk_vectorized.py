@@ -5,48 +5,151 @@ Author: Enrique A. Alcantara
 Description: Simulates a 2D random walk using NumPy vectorization for high performance.
 """
 
+import argparse
 import numpy as np
-import matplotlib.pyplot as plt
 
-def simulate_random_walk(n_steps=50000):
+# Numba is optional: without it the walk falls back to the vectorized NumPy path
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Step tables indexed by a 2-bit move code: Up, Down, Right, Left
+_DX_LUT = np.array([0, 0, 1, -1], dtype=np.int8)
+_DY_LUT = np.array([1, -1, 0, 0], dtype=np.int8)
+# Bit offsets of the 4 move codes packed in each byte
+_BYTE_SHIFTS = np.array([0, 2, 4, 6], dtype=np.uint8)
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _walk_into(words, x, y):
+        """
+        Fused random walk kernel. Each uint64 word packs 32 moves as 2-bit
+        codes, which are decoded through the step tables and accumulated
+        straight into the x, y buffers, without intermediate step arrays.
+        """
+        x[0] = 0
+        y[0] = 0
+        for i in range(x.size - 1):
+            r = (words[i >> 5] >> np.uint64(2 * (i & 31))) & np.uint64(3)
+            x[i + 1] = x[i] + _DX_LUT[r]
+            y[i + 1] = y[i] + _DY_LUT[r]
+
+    @njit(cache=True)
+    def _walk_kernel(words, n_steps):
+        """Runs a single walk of n_steps moves."""
+        x = np.empty(n_steps + 1, np.int32)
+        y = np.empty(n_steps + 1, np.int32)
+        _walk_into(words, x, y)
+        return x, y
+
+    @njit(cache=True, parallel=True)
+    def _ensemble_kernel(words, n_steps):
+        """Runs one independent walk per row of words, spread across all cores."""
+        n_walks = words.shape[0]
+        xs = np.empty((n_walks, n_steps + 1), np.int32)
+        ys = np.empty((n_walks, n_steps + 1), np.int32)
+        for w in prange(n_walks):
+            _walk_into(words[w], xs[w], ys[w])
+        return xs, ys
+
+def _draw_words(rng, shape):
+    """
+    Draws the packed move codes shared by both backends, 2 random bits per step:
+    all 64 bits of each PCG64 output are used. shape is (..., n_steps).
+    """
+    *lead, n_steps = shape
+    return rng.integers(0, 2**64, size=(*lead, (n_steps + 31) // 32), dtype=np.uint64)
+
+def _simulate_random_walk_numpy(words, n_steps):
+    """
+    Vectorized NumPy implementation, used when Numba is not installed.
+    Decodes the same packed words as the Numba kernel, so a given seed
+    produces the same walk on either backend.
     """
-    Simulates a 2D random walk using NumPy vectorization.
+    # 1. Unpack the 2-bit move codes (Vectorization)
+    # Little-endian bytes hold 4 consecutive moves each, lowest bits first
+    packed = words.astype('<u8', copy=False).view(np.uint8)
+    r = ((packed[:, np.newaxis] >> _BYTE_SHIFTS) & 3).ravel()[:n_steps]
+    
+    # 2. Decode each code into two independent contiguous int8 step vectors
+    dx = _DX_LUT[r]
+    dy = _DY_LUT[r]
+    
+    # 3. Calculate cumulative position (Trajectory)
+    # np.cumsum integrates the steps: position[t] = sum(velocity[0..t])
+    # Upcast to int32 only at the reduction, writing straight after the origin (0,0)
+    x = np.empty(n_steps + 1, dtype=np.int32)
+    y = np.empty(n_steps + 1, dtype=np.int32)
+    x[0] = 0
+    y[0] = 0
+    np.cumsum(dx, dtype=np.int32, out=x[1:])
+    np.cumsum(dy, dtype=np.int32, out=y[1:])
+    
+    return x, y
+
+def simulate_random_walk(n_steps=50000, rng=None):
+    """
+    Simulates a 2D random walk.
+    Uses the fused Numba kernel when available, NumPy vectorization otherwise;
+    both decode the same random bits, so results do not depend on the backend.
     
     Args:
         n_steps (int): Number of steps to simulate.
+        rng (None, int or np.random.Generator): Seed or PCG64 generator,
+            passed to np.random.default_rng for reproducible walks.
     
     Returns:
         tuple: Arrays of x and y coordinates representing the trajectory.
     """
-    # 1. Define possible moves (Up, Down, Left, Right)
-    # [dx, dy]
-    options = [
-        [0, 1],   # Up
-        [0, -1],  # Down
-        [1, 0],   # Right
-        [-1, 0]   # Left
-    ]
-    
-    # 2. Generate random choices for all steps at once (Vectorization)
-    # This avoids using slow Python loops for large N
-    indices = np.random.choice(len(options), size=n_steps)
-    steps = np.array(options)[indices]
+    words = _draw_words(np.random.default_rng(rng), (n_steps,))
+    if HAS_NUMBA:
+        return _walk_kernel(words, n_steps)
+    return _simulate_random_walk_numpy(words, n_steps)
+
+def simulate_random_walk_ensemble(n_walks, n_steps=50000, rng=None):
+    """
+    Simulates an ensemble of independent 2D random walks, e.g. to estimate <r^2>.
+    With Numba, the walks run in parallel across all cores.
     
-    # 3. Calculate cumulative position (Trajectory)
-    # np.cumsum integrates the steps: position[t] = sum(velocity[0..t])
-    x = np.cumsum(steps[:, 0])
-    y = np.cumsum(steps[:, 1])
+    Args:
+        n_walks (int): Number of independent walks.
+        n_steps (int): Number of steps per walk.
+        rng (None, int or np.random.Generator): Seed or PCG64 generator,
+            passed to np.random.default_rng for reproducible ensembles.
     
-    # Insert origin (0,0) at the start
-    x = np.insert(x, 0, 0)
-    y = np.insert(y, 0, 0)
+    Returns:
+        tuple: (n_walks, n_steps + 1) arrays of x and y coordinates, one walk per row.
+    """
+    # Random bits are drawn up front so results depend neither on thread
+    # scheduling nor on the backend
+    words = _draw_words(np.random.default_rng(rng), (n_walks, n_steps))
+    if HAS_NUMBA:
+        return _ensemble_kernel(words, n_steps)
     
-    return x, y
+    xs = np.empty((n_walks, n_steps + 1), dtype=np.int32)
+    ys = np.empty((n_walks, n_steps + 1), dtype=np.int32)
+    for w in range(n_walks):
+        xs[w], ys[w] = _simulate_random_walk_numpy(words[w], n_steps)
+    return xs, ys
 
 # --- Execution Block ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="2D Random Walk Simulation")
+    parser.add_argument('--no-show', action='store_true',
+                        help="save the figure without opening a window (batch runs)")
+    args = parser.parse_args()
+    
+    # Plotting libraries are only needed when run as a script, keeping imports light
+    import matplotlib
+    if args.no_show:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    
     # Configuration
     N = 50000
+    PLOT_STRIDE = 5  # Plot every 5th point; indistinguishable at 100 dpi
     
     print(f"Running simulation for {N} steps...")
     
@@ -55,7 +158,8 @@ if __name__ == "__main__":
     
     # Visualization
     plt.figure(figsize=(10, 6))
-    plt.plot(x_traj, y_traj, linewidth=0.5, alpha=0.8, color='#4c00b0') # Nu Purple ;)
+    plt.plot(x_traj[::PLOT_STRIDE], y_traj[::PLOT_STRIDE], linewidth=0.5, alpha=0.8,
+             color='#4c00b0', rasterized=True) # Nu Purple ;)
     
     # Mark Start and End
     plt.plot(0, 0, 'go', label='Start (0,0)', markersize=8)
@@ -73,4 +177,5 @@ if __name__ == "__main__":
     plt.savefig(output_filename, dpi=100)
     print(f"Simulation complete. Graph saved to {output_filename}")
     
-    plt.show()
+    if not args.no_show:
+        plt.show()